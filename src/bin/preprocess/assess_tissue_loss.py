@@ -9,6 +9,7 @@ import dask.array as da
 import numpy as np
 import numpy.typing as npt
 import zarr
+from joblib import delayed, Parallel
 from PIL import ImageFont, Image, ImageDraw
 from ome_types import from_xml
 from ome_types.model import Pixels
@@ -69,21 +70,15 @@ class SceneStack:
     offset_px: Point2D
 
     @classmethod
-    def from_path(cls, path: Path, ref_channel: int, vis_level: int):
+    def from_path(
+        cls, path: Path, pyramid: list[da.Array], ref_channel: int, vis_level: int
+    ):
         with TiffReader(path) as reader:
             ome = from_xml(reader.ome_metadata, parser="lxml")
             pixels = ome.images[0].pixels
             pixel_size = _get_pixel_size(pixels)
             base_position = _get_position(pixels)
 
-        # FIXME: measure difference in ome.tiff vs ome.zarr
-        # why is reading ome.tiff so dang slow?
-        zgroup = zarr.open(store=tifffile.imread(path, aszarr=True), mode="r")
-        pyramid = [
-            da.from_zarr(zgroup[int(dataset["path"])])
-            for dataset in zgroup.attrs["multiscales"][0]["datasets"]
-        ]
-
         channel_params = [
             {**json.loads(c.name), "index": i} for i, c in enumerate(pixels.channels)
         ]
@@ -137,24 +132,18 @@ class SceneStack:
         return Point2D(y=exemplar_shape[0], x=exemplar_shape[1])
 
 
-def _get_highest_common_vis_level(image_paths: list[Path]):
-    vis_levels = []
-    for path in image_paths:
-        zgroup = zarr.open(store=tifffile.imread(path, aszarr=True), mode="r")
-        datasets = zgroup.attrs["multiscales"][0]["datasets"]
-        levels = [int(d["path"]) for d in datasets]
-        vis_levels.append(max(levels))
-
-    return min(vis_levels)
-
-
-def _get_dtype(path: Path):
+def _open_pyramid(path: Path) -> list[da.Array]:
+    """
+    Opening the store walks every IFD in the file, so we do it once per image and
+    share the resulting levels, instead of reopening for each piece of information.
+    """
+    # FIXME: measure difference in ome.tiff vs ome.zarr
+    # why is reading ome.tiff so dang slow?
     zgroup = zarr.open(store=tifffile.imread(path, aszarr=True), mode="r")
-    layer = -1
-    dtype = da.from_zarr(
-        zgroup[int(zgroup.attrs["multiscales"][0]["datasets"][layer]["path"])]
-    ).dtype
-    return dtype
+    return [
+        da.from_zarr(zgroup[int(dataset["path"])])
+        for dataset in zgroup.attrs["multiscales"][0]["datasets"]
+    ]
 
 
 def _write_avi(frames: list[npt.NDArray], dst: Path, fps: float):
@@ -186,12 +175,18 @@ class SlideStack:
 
     @classmethod
     def from_paths(cls, image_paths: list[Path], ref_channel: int):
-        vis_level = _get_highest_common_vis_level(image_paths)
-        dtype = _get_dtype(image_paths[0])
+        # metadata reads are latency-bound, so open all images concurrently
+        pyramids: list[list[da.Array]] = Parallel(n_jobs=-1, prefer="threads")(
+            delayed(_open_pyramid)(path) for path in image_paths
+        )
+        vis_level = min(len(pyramid) for pyramid in pyramids) - 1
+        dtype = pyramids[0][-1].dtype
 
         scene_stacks = [
-            SceneStack.from_path(path, ref_channel=ref_channel, vis_level=vis_level)
-            for path in image_paths
+            SceneStack.from_path(
+                path, pyramid=pyramid, ref_channel=ref_channel, vis_level=vis_level
+            )
+            for path, pyramid in zip(image_paths, pyramids)
         ]
 
         return cls(scene_stacks=scene_stacks, orig_dtype=dtype)
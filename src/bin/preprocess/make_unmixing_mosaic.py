@@ -3,70 +3,103 @@ from dataclasses import dataclass
 from pathlib import Path
 from typing import Callable
 
-import dask.array as da
 import numpy as np
 import numpy.typing as npt
+import zarr
 from bmd_perf.profiling import timed_ctx
-from dask import delayed as dask_delayed
-from joblib import delayed as joblib_delayed, Parallel
+from distributed import get_client
+from joblib import delayed as joblib_delayed, Memory, Parallel
+from numba import njit
 from ome_types import from_xml
-from skimage import img_as_float
-from skimage.transform import downscale_local_mean
 from tifffile import TiffReader, tifffile
 
 from broadside.adjustments.alignment import (
     get_spectral_bands,
     get_scales_shifts,
     SpectralBand,
-    shift_image,
-    scale_image,
+    scale_and_shift_image,
 )
 from broadside.adjustments.hot_pixels import get_remove_hot_pixels_func
-from broadside.utils.arrays import square_concat
+from broadside.adjustments.illumination import correct_illumination
+from broadside.utils.arrays import downscale_mean, get_square_grid
 from broadside.utils.io import read_paths
-from broadside.utils.parallel import dask_session
+from broadside.utils.parallel import dask_session, map_bounded
 
 
-def read_tile(
+@njit()
+def get_saturation_mask(image: npt.NDArray, max_value: int) -> npt.NDArray:
+    """
+    Same as `np.logical_or.reduce(image >= max_value, axis=0)`, but in one pass over the
+    raw image, without a temporary boolean array the size of the whole stack.
+    """
+    assert image.ndim == 3
+
+    n_c, h, w = image.shape
+    mask = np.zeros((h, w), dtype=np.uint8)
+    for y in range(h):
+        for x in range(w):
+            for c in range(n_c):
+                if image[c, y, x] >= max_value:
+                    mask[y, x] = 1
+                    break
+    return mask
+
+
+def correct_tile(
     path: Path,
+    mtime_ns: int,
     *,
+    calibration: tuple,
     remove_hot_pixels: Callable,
-    flat_path: Path,
-    dark_path: Path,
+    flatfield: npt.NDArray,
+    darkfield: npt.NDArray,
     scales: dict,
     shifts: dict,
     bands: list[SpectralBand],
-    mid_chunk_size: int,
-    downsample: int,
     max_value: int,
-):
+) -> tuple[npt.NDArray, npt.NDArray]:
+    """
+    Reads a tile and applies every correction that doesn't depend on how the tile is
+    placed in the mosaic, returning the corrected tile and its saturation mask.
+
+    This is where almost all the time goes, so it is memoized on disk when a cache
+    directory is given. `mtime_ns` and `calibration` are not used here, but are part of
+    the cache key: they stand in for the tile itself and for the arguments that are
+    too large or opaque to hash (the hot pixel function and illumination profiles).
+    """
     image: npt.NDArray = tifffile.imread(path)
 
     # prepare mask
-    mask = np.logical_or.reduce(image >= max_value, axis=0)
-    assert mask.ndim == 2
-    mask = mask.astype(float)
+    mask = get_saturation_mask(image, max_value)
 
-    image = img_as_float(image)
+    # rescale to [0, 1] by the range of the dtype, like img_as_float does, but in
+    # float32 and folded into the illumination correction; hot pixels are replaced by
+    # the median of their neighbors, which doesn't care about the scaling
+    scale = 1 / np.iinfo(image.dtype).max
+    image = image.astype(np.float32)
     image = remove_hot_pixels(image)
 
-    # flatfield and darkfield take up a decent amount of space
-    flatfield: npt.NDArray = tifffile.imread(flat_path)
-    darkfield: npt.NDArray = tifffile.imread(dark_path)
-    image -= darkfield
-    image /= flatfield
-    del flatfield
-    del darkfield
+    correct_illumination(
+        image,
+        np.broadcast_to(darkfield, image.shape),
+        np.broadcast_to(flatfield, image.shape),
+        scale,
+    )
 
     channels = []
     for channel, band in zip(image, bands):
         scale = scales[band.cube][band.wavelength]
         shift = shifts[band.cube][band.wavelength]
-        channel = scale_image(channel, scale)
-        channel = shift_image(channel, shift)
+        channel = scale_and_shift_image(channel, scale, shift)
         channels.append(channel)
     image = np.stack(channels)
 
+    return image, mask
+
+
+def crop_and_downsample(
+    image: npt.NDArray, mask: npt.NDArray, *, mid_chunk_size: int, downsample: int
+) -> npt.NDArray:
     # take middle chunk
     h, w = image.shape[-2:]
     h0 = max(0, h // 2 - mid_chunk_size // 2)
@@ -77,8 +110,8 @@ def read_tile(
     image = image[:, h0:h1, w0:w1]
     mask = mask[h0:h1, w0:w1]
 
-    scaled = downscale_local_mean(image, (1, downsample, downsample))
-    mask = downscale_local_mean(mask, (downsample, downsample))
+    scaled = downscale_mean(image, downsample, dtype=np.float32)
+    mask = downscale_mean(mask, downsample, dtype=np.float32)
     # a little less than 1, to make sure that we get rid of blown out signal in the
     # downscaled image
     threshold = 0.8 / downsample
@@ -88,35 +121,85 @@ def read_tile(
     return scaled
 
 
+def read_tile(
+    path: Path,
+    *,
+    correct_tile_func: Callable,
+    calibration: tuple,
+    remove_hot_pixels: Callable,
+    flatfield: npt.NDArray,
+    darkfield: npt.NDArray,
+    scales: dict,
+    shifts: dict,
+    bands: list[SpectralBand],
+    mid_chunk_size: int,
+    downsample: int,
+    max_value: int,
+):
+    image, mask = correct_tile_func(
+        path,
+        path.stat().st_mtime_ns,
+        calibration=calibration,
+        remove_hot_pixels=remove_hot_pixels,
+        flatfield=flatfield,
+        darkfield=darkfield,
+        scales=scales,
+        shifts=shifts,
+        bands=bands,
+        max_value=max_value,
+    )
+    return crop_and_downsample(
+        image, mask, mid_chunk_size=mid_chunk_size, downsample=downsample
+    )
+
+
 @dataclass(frozen=True)
 class TileQC:
     path: Path
     ipr: float  # inter-percentile range
 
 
-def get_ipr(path: Path, channel: int, mid_chunk_size: int) -> TileQC:
+def get_ipr(path: Path, mtime_ns: int, channel: int, mid_chunk_size: int) -> TileQC:
+    """
+    `mtime_ns` is not used here, but it is part of the cache key when memoized, so
+    that a tile rewritten in place is not served a stale value.
+    """
     with TiffReader(path) as tif:
-        im = tif.pages[channel].asarray(maxworkers=1)
-    assert im.ndim == 2
-    h, w = im.shape
-
-    h0 = max(0, h // 2 - mid_chunk_size // 2)
-    h1 = min(h, h // 2 + mid_chunk_size // 2)
-    w0 = max(0, w // 2 - mid_chunk_size // 2)
-    w1 = min(w, w // 2 + mid_chunk_size // 2)
-
-    im = im[h0:h1, w0:w1]
+        page = tif.pages[channel]
+        assert page.ndim == 2
+        h, w = page.shape
+
+        h0 = max(0, h // 2 - mid_chunk_size // 2)
+        h1 = min(h, h // 2 + mid_chunk_size // 2)
+        w0 = max(0, w // 2 - mid_chunk_size // 2)
+        w1 = min(w, w // 2 + mid_chunk_size // 2)
+
+        # only decode the strips/tiles that overlap the middle chunk
+        with page.aszarr() as store:
+            im = zarr.open(store=store, mode="r")[h0:h1, w0:w1]
     p_lo, p_hi = np.percentile(im, (10, 90))
     return TileQC(path=path, ipr=(p_hi - p_lo).item())
 
 
 def get_high_contrast_paths(
-    paths: list[Path], *, n_tiles: int, channel: int, mid_chunk_size: int
+    paths: list[Path],
+    *,
+    n_tiles: int,
+    channel: int,
+    mid_chunk_size: int,
+    cache_dir: Path | None = None,
 ):
+    # tiles are never modified after acquisition, so their contrasts can be reused
+    # across runs; with no cache dir, joblib simply calls the function
+    get_ipr_cached = Memory(cache_dir, verbose=0).cache(get_ipr)
+
     with timed_ctx("get tile contrasts"):
         tiles_qc: list[TileQC] = Parallel(n_jobs=-1, prefer="threads")(
-            joblib_delayed(get_ipr)(
-                path, channel=channel, mid_chunk_size=mid_chunk_size
+            joblib_delayed(get_ipr_cached)(
+                path,
+                path.stat().st_mtime_ns,
+                channel=channel,
+                mid_chunk_size=mid_chunk_size,
             )
             for path in paths
         )
@@ -136,6 +219,7 @@ def make_unmixing_mosaic(
     scales_shifts_dir: Path,
     ref_channel: int,
     dst: Path,
+    cache_dir: Path | None = None,
 ):
     """
     To generate the unmixing mosaic, we need a downsampled form of acquired images. The
@@ -147,15 +231,21 @@ def make_unmixing_mosaic(
     that the proper adjustments can be made before assembling the mosaic.
     """
 
+    # tiles are downsampled by block means, so the middle chunk has to divide evenly
+    assert mid_chunk_size % downsample == 0
+
     # change this below, since we'll be getting the list explicitly in production
     paths = read_paths(tiles_path)
     paths = get_high_contrast_paths(
-        paths, n_tiles=n_tiles, mid_chunk_size=mid_chunk_size, channel=ref_channel
+        paths,
+        n_tiles=n_tiles,
+        mid_chunk_size=mid_chunk_size,
+        channel=ref_channel,
+        cache_dir=cache_dir,
     )
 
     # get exemplar tile metadata
     with TiffReader(paths[0]) as reader:
-        shape = reader.series[0].shape
         ome = from_xml(reader.ome_metadata, parser="lxml")
         pixels = ome.images[0].pixels
         ts = ome.images[0].acquisition_date.timestamp()
@@ -166,27 +256,60 @@ def make_unmixing_mosaic(
     bands = get_spectral_bands(pixels)
     scales, shifts = get_scales_shifts(ts, scales_shifts_dir=scales_shifts_dir)
 
-    new_shape = [shape[0], mid_chunk_size, mid_chunk_size]
-
-    delayeds = [
-        dask_delayed(read_tile)(
-            path,
-            remove_hot_pixels=remove_hot_pixels,
-            flat_path=flat_path,
-            dark_path=dark_path,
-            scales=scales,
-            shifts=shifts,
-            bands=bands,
-            mid_chunk_size=mid_chunk_size,
-            downsample=downsample,
-            max_value=max_value,
-        )
-        for path in paths
-    ]
-    delayeds = [da.from_delayed(d, shape=new_shape, dtype=float) for d in delayeds]
-    stack = da.stack(delayeds)
-    stack = stack.compute()
-    mosaic = square_concat(list(stack))
+    # flatfield and darkfield take up a decent amount of space, so instead of passing
+    # them with every task (one copy each), or having every task read them from disk,
+    # we read them once and keep a single copy on each worker
+    client = get_client()
+    flatfield = client.scatter(
+        tifffile.imread(flat_path).astype(np.float32), broadcast=True
+    )
+    darkfield = client.scatter(
+        tifffile.imread(dark_path).astype(np.float32), broadcast=True
+    )
+
+    # corrected tiles only depend on the tile and the calibration, so they can be
+    # reused across runs that only change how tiles are cropped and downsampled; the
+    # calibration is keyed on where it came from, since it is too large to hash
+    correct_tile_func = Memory(cache_dir, verbose=0).cache(
+        correct_tile, ignore=["remove_hot_pixels", "flatfield", "darkfield"]
+    )
+    calibration = (
+        str(flat_path),
+        flat_path.stat().st_mtime_ns,
+        str(dark_path),
+        dark_path.stat().st_mtime_ns,
+        str(dark_dir),
+        dark_dir.stat().st_mtime_ns,
+        ts,
+    )
+
+    # stream tiles back as they finish instead of computing the whole stack at once,
+    # so that the cluster only ever holds a handful of processed tiles, and write each
+    # one straight into its place in the mosaic
+    mosaic: npt.NDArray | None = None
+    for i, tile in map_bounded(
+        read_tile,
+        paths,
+        correct_tile_func=correct_tile_func,
+        calibration=calibration,
+        remove_hot_pixels=remove_hot_pixels,
+        flatfield=flatfield,
+        darkfield=darkfield,
+        scales=scales,
+        shifts=shifts,
+        bands=bands,
+        mid_chunk_size=mid_chunk_size,
+        downsample=downsample,
+        max_value=max_value,
+    ):
+        # all tiles have the same shape, so whichever finishes first sets the layout
+        if mosaic is None:
+            h, w = tile.shape[-2:]
+            ny, nx = get_square_grid(len(paths), h, w)
+            mosaic = np.zeros(tile.shape[:-2] + (ny * h, nx * w), dtype=np.float32)
+
+        iy, ix = divmod(i, nx)
+        mosaic[..., h * iy : h * (iy + 1), w * ix : w * (ix + 1)] = tile
 
     dst.parent.mkdir(exist_ok=True, parents=True)
     tifffile.imwrite(dst, mosaic, photometric="minisblack")
@@ -204,6 +327,7 @@ def run():
     parser.add_argument("--scales-shifts-dir", type=str, required=True)
     parser.add_argument("--ref-channel", type=int, required=True)
     parser.add_argument("--dst", type=str, required=True)
+    parser.add_argument("--cache-dir", type=str, default=None)
 
     parser.add_argument("--n-cpus", type=int, default=None)
     parser.add_argument("--memory-limit", type=str, default=None)
@@ -227,4 +351,5 @@ def run():
             scales_shifts_dir=Path(args.scales_shifts_dir),
             ref_channel=args.ref_channel,
             dst=Path(args.dst),
+            cache_dir=None if args.cache_dir is None else Path(args.cache_dir),
         )
@@ -46,13 +46,13 @@ def get_scene_center(
 
 
 def unique_list(objs: list, key: Callable):
-    keys = []
+    keys = set()
     s = []
     for obj in objs:
         k = key(obj)
         if k not in keys:
             s.append(obj)
-            keys.append(k)
+            keys.add(k)
 
     return s
 
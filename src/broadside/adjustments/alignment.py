@@ -7,7 +7,12 @@ import numpy as np
 import numpy.typing as npt
 import pandas as pd
 from ome_types.model import Pixels
-from skimage.transform import SimilarityTransform, warp, EuclideanTransform
+from skimage.transform import (
+    AffineTransform,
+    EuclideanTransform,
+    SimilarityTransform,
+    warp,
+)
 
 from broadside.utils.geoms import Point2D
 from broadside.utils.search import find_nearest
@@ -33,6 +38,20 @@ def shift_image(im: npt.NDArray, shift: Point2D) -> npt.NDArray:
     return warp(im, tr.inverse, mode="edge", order=WARP_ORDER)
 
 
+def scale_and_shift_image(im: npt.NDArray, scale: float, shift: Point2D) -> npt.NDArray:
+    """
+    Same as `shift_image(scale_image(im, scale), shift)`, but with both transforms
+    composed into one, so the image is only resampled (and interpolated) once.
+    """
+    h, w = im.shape[-2:]
+    dx = (scale - 1) * w / 2
+    dy = (scale - 1) * h / 2
+    scale_tr = SimilarityTransform(scale=scale, translation=[-dx, -dy])
+    shift_tr = EuclideanTransform(translation=[shift.x, shift.y])
+    tr = AffineTransform(matrix=shift_tr.params @ scale_tr.params)
+    return warp(im, tr.inverse, mode="edge", order=WARP_ORDER)
+
+
 @lru_cache
 def get_scales_shifts(ts: float, *, scales_shifts_dir: Path) -> tuple[dict, dict]:
     re_csv = re.compile("(?P<ts>[0-9]+).csv")
@@ -85,7 +104,7 @@ def get_scales_shifts(ts: float, *, scales_shifts_dir: Path) -> tuple[dict, dict
     return scales, shifts
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class SpectralBand:
     cube: str
     wavelength: int
@@ -0,0 +1,26 @@
+import numpy.typing as npt
+from numba import njit
+
+
+@njit(fastmath=True)
+def correct_illumination(
+    image: npt.NDArray, darkfield: npt.NDArray, flatfield: npt.NDArray, scale: float
+) -> npt.NDArray:
+    """
+    Equivalent to `image = (image * scale - darkfield) / flatfield`, but done in place
+    and in a single pass, instead of one full pass (and temporary) per operation; tiles
+    are large enough that this is bound by memory bandwidth, not arithmetic.
+
+    The darkfield and flatfield must have the same shape as the image; use
+    `np.broadcast_to` if they don't.
+    """
+    assert image.ndim == 3
+
+    n_c, h, w = image.shape
+    for c in range(n_c):
+        for y in range(h):
+            for x in range(w):
+                image[c, y, x] = (
+                    image[c, y, x] * scale - darkfield[c, y, x]
+                ) / flatfield[c, y, x]
+    return image
@@ -4,14 +4,23 @@ import numpy as np
 import numpy.typing as npt
 
 
+def get_square_grid(n: int, h: int, w: int) -> tuple[int, int]:
+    """
+    Rows and columns of a grid of `n` arrays of shape (h, w) that is roughly square;
+    array `i` goes in row `i // nx` and column `i % nx`.
+    """
+    ny = int(math.ceil(math.sqrt(n) * w / h))
+    nx = int(math.ceil(n / ny))
+    return ny, nx
+
+
 def square_concat(arrays: list[npt.NDArray]) -> npt.NDArray:
     first = arrays[0]
     h, w = first.shape[-2:]
 
     n = len(arrays)
 
-    ny = int(math.ceil(math.sqrt(n) * w / h))
-    nx = int(math.ceil(n / ny))
+    ny, nx = get_square_grid(n, h, w)
 
     dest_shape = (first.shape[:-2]) + (ny * h, nx * w)
     dest = np.empty(dest_shape, dtype=first.dtype)
@@ -27,3 +36,20 @@ def square_concat(arrays: list[npt.NDArray]) -> npt.NDArray:
             dest[..., h * iy : h * (iy + 1), w * ix : w * (ix + 1)] = a
 
     return dest
+
+
+def downscale_mean(
+    arr: npt.NDArray, factor: int, dtype: npt.DTypeLike | None = None
+) -> npt.NDArray:
+    """
+    Mean over non-overlapping `factor` x `factor` blocks of the last two axes.
+
+    Unlike skimage's downscale_local_mean, the last two axes have to be divisible by
+    `factor`, which lets this be a single reshape and reduction without any padding.
+    """
+    h, w = arr.shape[-2:]
+    if (h % factor != 0) or (w % factor != 0):
+        raise ValueError(f"Shape {(h, w)} is not divisible by {factor}")
+
+    blocks = arr.reshape(arr.shape[:-2] + (h // factor, factor, w // factor, factor))
+    return blocks.mean(axis=(-3, -1), dtype=dtype)
@@ -1,7 +1,7 @@
 from dataclasses import dataclass
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class Range:
     min: float
     max: float
@@ -14,7 +14,7 @@ class Range:
         return self.min <= value <= self.max
 
 
-@dataclass
+@dataclass(slots=True)
 class Point2D:
     """
     I like being strict about the dunder methods.
@@ -39,7 +39,7 @@ class Point2D:
         return dict(x=self.x, y=self.y)
 
 
-@dataclass
+@dataclass(slots=True)
 class Point3D:
     x: float
     y: float
@@ -63,13 +63,13 @@ class Point3D:
         return dict(x=self.x, y=self.y, z=self.z)
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class Size:
     w: float
     h: float
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class Rect:
     origin: Point2D
     size: Size
@@ -1,6 +1,14 @@
 import contextlib
+import itertools
+from typing import Callable, Iterable, Iterator
 
-from distributed import Client, LocalCluster, performance_report
+from distributed import (
+    Client,
+    LocalCluster,
+    as_completed,
+    get_client,
+    performance_report,
+)
 
 
 class dask_session:
@@ -50,3 +58,38 @@ class dask_session:
             self.report.__exit__(*args)
         finally:
             self.client.__exit__(*args)
+
+
+def map_bounded(
+    func: Callable, items: Iterable, *, max_in_flight: int | None = None, **kwargs
+) -> Iterator[tuple[int, object]]:
+    """
+    Yields (index, result) of `func(item, **kwargs)` for each item, in order of
+    completion, on the current dask client.
+
+    Unlike computing a whole collection at once, only `max_in_flight` tasks (by default,
+    the number of worker threads) are submitted at any time, and each result is
+    released from the cluster as soon as it is yielded, so finished results don't pile
+    up on the workers.
+    """
+    client = get_client()
+    if max_in_flight is None:
+        max_in_flight = sum(client.nthreads().values())
+
+    pending = enumerate(items)
+    indexes = {}
+    futures = as_completed()
+
+    def submit(n: int):
+        for i, item in itertools.islice(pending, n):
+            future = client.submit(func, item, pure=False, **kwargs)
+            indexes[future.key] = i
+            futures.add(future)
+
+    submit(max_in_flight)
+    for future in futures:
+        result = future.result()
+        i = indexes.pop(future.key)
+        future.release()
+        submit(1)
+        yield i, result